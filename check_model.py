@@ -1,5 +1,14 @@
-from ultralytics import YOLO
+import torch
 
-model = YOLO("best.pt")
-print("CLASSES:", model.names)
-print("NUMBER OF CLASSES:", len(model.names))
+# Only the class names are needed, so read them from the checkpoint
+# instead of building the full YOLO model
+ckpt = torch.load("best.pt", map_location="cpu", weights_only=False)
+# Checkpoints saved mid-training keep the network under "ema" with
+# "model" set to None; resolve it the same way Ultralytics does
+m = ckpt.get("ema") or ckpt.get("model")
+names = getattr(m, "names", None) or ckpt.get("names")
+if not names:
+    raise SystemExit("best.pt has no class names (no names on ema/model and no names entry)")
+
+print("CLASSES:", names)
+print("NUMBER OF CLASSES:", len(names))
@@ -0,0 +1,7 @@
+from ultralytics import YOLO
+
+# One-off offline step for food_detector_app2.py: export the PyTorch
+# weights to yolov8n.onnx. Dynamic axes keep batched uploads and other
+# input sizes working. Needs the onnx and onnxruntime packages.
+path = YOLO("yolov8n.pt").export(format="onnx", imgsz=640, dynamic=True)
+print("EXPORTED:", path)
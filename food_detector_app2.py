@@ -2,10 +2,12 @@ import streamlit as st
 from ultralytics import YOLO
 import cv2
 import numpy as np
-from PIL import Image
-import tempfile
-import json
+import pandas as pd
+import orjson
 import os
+import atexit
+import threading
+import tempfile
 from datetime import datetime
 
 # ---------------------------------------------------
@@ -54,34 +56,204 @@ NUTRITION = {
     "rajma": {"calories": 230},            # 1 cup
 }
 
+NUTRITION_KEYS = tuple(NUTRITION.keys())
+NUTRITION_INDEX = {n: i for i, n in enumerate(NUTRITION_KEYS)}
+CAL_ARR = np.array([NUTRITION[k]["calories"] for k in NUTRITION_KEYS], dtype=np.int32)
+
 
 MEAL_TYPES = ["Breakfast", "Lunch", "Dinner", "Snacks"]
 
+TODAY = datetime.now().strftime("%Y-%m-%d")
+
+# Activity multiplier
+ACTIVITY_MULT = {
+    "Sedentary": 1.2,
+    "Lightly Active": 1.375,
+    "Moderately Active": 1.55,
+    "Very Active": 1.725,
+    "Extra Active": 1.9,
+}
+
 # ---------------------------------------------------
 # Load YOLO Model
 # ---------------------------------------------------
+# Created offline by export_model.py; inference runs through onnxruntime
+MODEL_ONNX = "yolov8n.onnx"
+
 @st.cache_resource
 def load_model():
-    return YOLO("yolov8n.pt")
+    m = YOLO(MODEL_ONNX, task="detect")
+
+    # Warm up once so session setup and kernel selection happen at
+    # startup rather than on the user's first upload
+    m.predict(np.zeros((640, 640, 3), dtype=np.uint8), imgsz=416, verbose=False)
+    return m
+
+if not os.path.exists(MODEL_ONNX):
+    st.error(f"{MODEL_ONNX} not found. Run `python export_model.py` once to create it.")
+    st.stop()
 
 model = load_model()
 
+@st.cache_resource
+def load_lower_names():
+    # Built once per process rather than on every rerun
+    return {i: n.lower() for i, n in model.names.items()}
+
+@st.cache_resource
+def load_valid_ids():
+    # Class ids whose name has a NUTRITION entry
+    return frozenset(i for i, n in load_lower_names().items() if n in NUTRITION)
+
+LOWER_NAMES = load_lower_names()
+VALID_IDS = load_valid_ids()
+
+@st.cache_resource
+def get_model_lock():
+    # The cached model is shared by all sessions and its predictor is
+    # not thread-safe, so inference calls take turns
+    return threading.Lock()
+
+MODEL_LOCK = get_model_lock()
+
 # ---------------------------------------------------
 # Load or Create Meal Log
 # ---------------------------------------------------
-LOG_FILE = "meal_log.json"
+LOG_FILE = "meal_log.jsonl"
+LEGACY_LOG_FILE = "meal_log.json"
 
 if not os.path.exists(LOG_FILE):
-    with open(LOG_FILE, "w") as f:
-        json.dump({}, f)
+    # One-time migration of the old {date: {meal: kcal}} log
+    lines = []
+    if os.path.exists(LEGACY_LOG_FILE):
+        try:
+            with open(LEGACY_LOG_FILE, "rb") as f:
+                legacy = orjson.loads(f.read())
+        except orjson.JSONDecodeError:
+            st.error(
+                f"Could not read **{LEGACY_LOG_FILE}**, so its meals were not "
+                f"imported. The file is left as is; starting a new log."
+            )
+            legacy = {}
+        for date, meals in legacy.items():
+            for meal, kcal in meals.items():
+                lines.append(orjson.dumps({"date": date, "meal": meal, "kcal": kcal}) + b"\n")
+
+    # Write to a unique temp file first so a half-finished migration isn't
+    # mistaken for a complete log, and sessions starting together don't
+    # move each other's file away
+    fd, tmp = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(LOG_FILE)), suffix=".tmp"
+    )
+    with os.fdopen(fd, "wb") as f:
+        f.write(b"".join(lines))
+    os.replace(tmp, LOG_FILE)
+
+# Adds are buffered and written in one batch at most this often
+FLUSH_INTERVAL = 5  # seconds
+
+def add_entry(totals, entry):
+    day = totals.setdefault(entry["date"], {m: 0 for m in MEAL_TYPES})
+    day[entry["meal"]] += entry["kcal"]
+
+@st.cache_data
+def aggregate(path, mtime):
+    # Fold the append-only log into {date: {meal: kcal}}.
+    # mtime is only part of the cache key, so a changed file is re-read.
+    totals = {}
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                entry = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                # Torn line left by an interrupted write
+                continue
+            add_entry(totals, entry)
+    return totals
+
+@st.cache_resource
+def log_buffer():
+    # Shared by all sessions so pending adds survive a closed tab;
+    # anything still pending is written when the server exits
+    buffer = {"entries": [], "timer": None, "lock": threading.Lock()}
+    atexit.register(flush_log, buffer)
+    return buffer
+
+def flush_log(buffer):
+    with buffer["lock"]:
+        entries, buffer["entries"] = buffer["entries"], []
+        buffer["timer"] = None
+        if entries:
+            with open(LOG_FILE, "a+b") as f:
+                # Start on a fresh line if a previous write was cut short
+                f.seek(0, os.SEEK_END)
+                if f.tell():
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        f.write(b"\n")
+                f.write(b"".join(orjson.dumps(e) + b"\n" for e in entries))
+    if entries:
+        aggregate.clear()
+
+def append_log(entry):
+    buffer = log_buffer()
+    with buffer["lock"]:
+        buffer["entries"].append(entry)
+        if buffer["timer"] is None:
+            timer = threading.Timer(FLUSH_INTERVAL, flush_log, args=(buffer,))
+            timer.daemon = True
+            timer.start()
+            buffer["timer"] = timer
 
 def load_log():
-    with open(LOG_FILE, "r") as f:
-        return json.load(f)
+    # Totals on disk plus adds still waiting in the buffer
+    buffer = log_buffer()
+    with buffer["lock"]:
+        totals = aggregate(LOG_FILE, os.path.getmtime(LOG_FILE))
+        pending = list(buffer["entries"])
+    for entry in pending:
+        add_entry(totals, entry)
+    return totals
+
+
+# ---------------------------------------------------
+# Daily Calorie Recommendation
+# ---------------------------------------------------
+@st.cache_data
+def compute_recommended(sex, age, weight, height, activity, goal):
+    # BMR
+    if sex == "Male":
+        bmr = 10 * weight + 6.25 * height - 5 * age + 5
+    else:
+        bmr = 10 * weight + 6.25 * height - 5 * age - 161
+
+    tdee = bmr * ACTIVITY_MULT[activity]
+
+    # Goal adjustment
+    if goal == "Lose Weight":
+        recommended = tdee - 500
+    elif goal == "Gain Weight":
+        recommended = tdee + 500
+    else:
+        recommended = tdee
 
-def save_log(data):
-    with open(LOG_FILE, "w") as f:
-        json.dump(data, f, indent=4)
+    return int(recommended)
+
+
+# ---------------------------------------------------
+# Image Display
+# ---------------------------------------------------
+def thumbnail(img, size):
+    # Shrink (never enlarge) so the longest side is at most `size`
+    h, w = img.shape[:2]
+    scale = size / max(h, w)
+    if scale >= 1:
+        return img
+    # Keep at least 1 px so very long or thin images don't collapse to 0
+    dsize = (max(1, round(w * scale)), max(1, round(h * scale)))
+    return cv2.resize(img, dsize, interpolation=cv2.INTER_AREA)
 
 
 # ---------------------------------------------------
@@ -106,43 +278,12 @@ with tab_profile:
     weight = st.number_input("Weight (kg)", 20, 300, 70, step=1, format="%d")
     height = st.number_input("Height (cm)", 120, 230, 170, step=1, format="%d")
 
-    activity = st.selectbox("Activity Level", [ 
-        "Sedentary",
-        "Lightly Active",
-        "Moderately Active",
-        "Very Active",
-        "Extra Active"
-    ])
+    activity = st.selectbox("Activity Level", list(ACTIVITY_MULT))
 
     goal = st.selectbox("Goal", ["Maintain", "Lose Weight", "Gain Weight"])
 
     if st.button("Calculate Daily Recommended Calories"):
-        # BMR
-        if sex == "Male":
-            bmr = 10 * weight + 6.25 * height - 5 * age + 5
-        else:
-            bmr = 10 * weight + 6.25 * height - 5 * age - 161
-
-        # Activity multiplier
-        mult = {
-            "Sedentary": 1.2,
-            "Lightly Active": 1.375,
-            "Moderately Active": 1.55,
-            "Very Active": 1.725,
-            "Extra Active": 1.9,
-        }[activity]
-
-        tdee = bmr * mult
-
-        # Goal adjustment
-        if goal == "Lose Weight":
-            recommended = tdee - 500
-        elif goal == "Gain Weight":
-            recommended = tdee + 500
-        else:
-            recommended = tdee
-
-        recommended = int(recommended)
+        recommended = compute_recommended(sex, age, weight, height, activity, goal)
 
         st.success(f"🎯 Daily Recommended Calories: **{recommended} kcal**")
         st.session_state["recommended"] = recommended
@@ -154,52 +295,73 @@ with tab_profile:
 with tab_detect:
     st.header("📸 Upload Food Image for Detection")
 
-    uploaded = st.file_uploader("Upload Image", type=["jpg", "jpeg", "png"])
-
-    if uploaded:
-        img = Image.open(uploaded).convert("RGB")
-        img_np = np.array(img)
-        st.image(img, width=500)
-
-        # Save temp file
-        temp = tempfile.NamedTemporaryFile(delete=False, suffix=".jpg")
-        img.save(temp.name)
-
-        # Detect
-        results = model(temp.name)[0]
+    # Smaller inputs are much faster; 416 is plenty for a 500 px preview
+    imgsz = st.sidebar.select_slider(
+        "Detection size (px)", options=[320, 416, 512, 640], value=416
+    )
+
+    uploaded = st.file_uploader(
+        "Upload Images", type=["jpg", "jpeg", "png"], accept_multiple_files=True
+    )
+
+    # Decode with OpenCV; BGR is what Ultralytics expects for arrays
+    files = []
+    imgs = []
+    for f in uploaded or []:
+        img_np = cv2.imdecode(np.frombuffer(f.getvalue(), np.uint8), cv2.IMREAD_COLOR)
+        if img_np is None:
+            st.error(f"Could not read **{f.name}** as an image; skipping it.")
+            continue
+        files.append(f)
+        imgs.append(img_np)
+
+    if imgs:
+        # Show a thumbnail; the full-res array is kept for detection
+        for f, img_np in zip(files, imgs):
+            st.image(thumbnail(img_np, 500), caption=f.name, channels="BGR")
+
+        # Detect all uploads in one batched call
+        with st.spinner("Detecting..."), MODEL_LOCK:
+            results_list = model(imgs, imgsz=imgsz, conf=0.25, verbose=False)
 
         st.subheader("🔍 Detected Items (Editable)")
 
-        final_items = []
-
-        for i, box in enumerate(results.boxes):
-            cls = int(box.cls[0])
-            detected_name = results.names[cls].lower()
-
-            # If YOLO detects unknown → default apple
-            if detected_name not in NUTRITION:
-                detected_name = "apple"
-
-            # Editable item name with UNIQUE KEY
-            name = st.selectbox(
-                f"Detected item {i+1}",
-                list(NUTRITION.keys()),
-                index=list(NUTRITION.keys()).index(detected_name),
-                key=f"label_{i}"
-            )
-
-            # Editable count with UNIQUE KEY + FIXED TYPE
-            count = st.number_input(
-                f"Count for {name}",
-                min_value=1,
-                max_value=20,
-                value=1,
-                step=1,
-                key=f"count_{i}",
-                format="%d"
-            )
-
-            final_items.append((name, count))
+        detected_names = []
+        sources = []
+
+        for f, results in zip(files, results_list):
+            # Move the boxes to the host once, before the Python loop
+            boxes = results.boxes.cpu()
+            cls_arr = boxes.cls.numpy().astype(int).tolist()
+
+            for cls in cls_arr:
+                # If YOLO detects unknown → default apple
+                detected_names.append(LOWER_NAMES[cls] if cls in VALID_IDS else "apple")
+                sources.append(f.name)
+
+        items = pd.DataFrame({
+            "image": sources,
+            "name": detected_names,
+            "count": [1] * len(detected_names),
+        })
+
+        # One editable table instead of a selectbox + number input per item
+        edited = st.data_editor(
+            items,
+            column_config={
+                "image": st.column_config.TextColumn("Image", disabled=True),
+                "name": st.column_config.SelectboxColumn(
+                    "Item", options=list(NUTRITION_KEYS), required=True
+                ),
+                "count": st.column_config.NumberColumn(
+                    "Count", min_value=1, max_value=20, step=1, required=True
+                ),
+            },
+            hide_index=True,
+        )
+
+        name_ids = edited["name"].map(NUTRITION_INDEX).to_numpy(dtype=np.intp)
+        counts = edited["count"].to_numpy(dtype=np.int32)
 
         st.write("---")
 
@@ -207,16 +369,9 @@ with tab_detect:
         meal_choice = st.selectbox("Add calories to:", MEAL_TYPES)
 
         if st.button("➕ Add to Meal Log"):
-            today = datetime.now().strftime("%Y-%m-%d")
-            log = load_log()
-
-            if today not in log:
-                log[today] = {m: 0 for m in MEAL_TYPES}
-
-            total_plate = sum(NUTRITION[name]["calories"] * count for name, count in final_items)
+            total_plate = int(np.dot(CAL_ARR[name_ids], counts))
 
-            log[today][meal_choice] += total_plate
-            save_log(log)
+            append_log({"date": TODAY, "meal": meal_choice, "kcal": total_plate})
 
             st.success(f"Added **{total_plate} kcal** to **{meal_choice}**")
 
@@ -227,13 +382,12 @@ with tab_detect:
 with tab_tracker:
     st.header("📘 Today’s Meal Summary")
 
-    today = datetime.now().strftime("%Y-%m-%d")
     log = load_log()
 
-    if today not in log:
+    if TODAY not in log:
         st.info("No meals logged today yet.")
     else:
-        meals = log[today]
+        meals = log[TODAY]
         total_today = sum(meals.values())
 
         st.write("### 🍽️ Calories by Meal")